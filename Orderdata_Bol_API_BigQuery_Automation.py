@@ -1,12 +1,35 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import argparse
 import base64
+import getpass
+import hashlib
 import time
+import random
+import sys
 import pandas as pd
 import os
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from google.oauth2 import service_account
-import pandas_gbq
+from google.cloud import bigquery
 import json
+import logging
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from contextlib import contextmanager
+from urllib.parse import urlencode
+import tempfile
+import threading
+
+log = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:
+    # fcntl bestaat niet op Windows; de token-cache werkt dan zonder bestandslock
+    fcntl = None
 
 # =================================================================
 # Configuratie Bol.com Retailer API
@@ -16,19 +39,59 @@ CLIENT_ID = os.environ.get('BOL_CLIENT_ID')
 CLIENT_SECRET = os.environ.get('BOL_CLIENT_SECRET')
 
 API_BASE_URL = 'https://api.bol.com/retailer'
+ORDERS_URL = f'{API_BASE_URL}/orders'
 TOKEN_URL = 'https://login.bol.com/token'
 
+# Map waarin het toegangstoken tussen runs van het script wordt bewaard. Standaard een eigen map per
+# gebruiker, zodat andere gebruikers op dezelfde machine het token niet kunnen lezen of vervangen.
+TOKEN_CACHE_MAP = os.environ.get(
+    'BOL_TOKEN_CACHE_DIR', os.path.join(tempfile.gettempdir(), f'bol_token_cache_{getpass.getuser()}'))
+# Het cachebestand hoort bij een client ID, zodat een run met andere credentials nooit dit token gebruikt
+CLIENT_ID_HASH = hashlib.sha256((CLIENT_ID or '').encode()).hexdigest()
+TOKEN_CACHE_BESTAND = os.path.join(TOKEN_CACHE_MAP, f'bol_token_{CLIENT_ID_HASH[:16]}.json')
+
 # =================================================================
 # Globale configuratie
 # =================================================================
 MAX_PAGINA = 1000
 PAGE_SIZE = 50
+# Aantal orderdetails dat tegelijk wordt opgevraagd
+MAX_GELIJKTIJDIGE_DETAILS = 10
+# Aantal dagen dat bij een backfill tegelijk wordt verwerkt
+MAX_GELIJKTIJDIGE_DAGEN = 4
 
 # --- RATE LIMIT CONFIGURATIE ---
-SLEEP_TIME_ORDERS = 60 / 20
-SLEEP_TIME_ORDER_DETAILS = 1 / 24
+# De orderlijst mag 20 keer per minuut worden aangeroepen
+ORDERS_PER_SECONDE = 20 / 60
+# De orderdetails mogen 24 keer per seconde worden opgevraagd
+ORDER_DETAILS_PER_SECONDE = 24
 MAX_RETRY_ATTEMPTS = 3
 
+# --- HTTP SESSIE ---
+# Een gedeelde sessie hergebruikt TCP/TLS-verbindingen over alle aanroepen heen (keep-alive).
+# urllib3 probeert alleen verbindingsfouten en serverfouten (500/502/504) opnieuw; rate limiting (429)
+# en onbeschikbaarheid (503) handelt maak_api_call_met_retry af, zodat elke poging via de limiter loopt
+# en Retry-After direct gevolgd wordt.
+# Elke gelijktijdige dag houdt een batch details tegelijk open, plus ruimte voor
+# de token- en opwarmaanroep
+HTTP_POOL_GROOTTE = MAX_GELIJKTIJDIGE_DAGEN * MAX_GELIJKTIJDIGE_DETAILS + 2
+# Maximale wachttijd in seconden op een verbinding of antwoord, zodat een aanroep nooit blijft hangen
+HTTP_TIMEOUT = 30
+
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=HTTP_POOL_GROOTTE,
+    pool_maxsize=HTTP_POOL_GROOTTE,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=1,
+        status_forcelist=[500, 502, 504],
+        allowed_methods=['GET', 'POST'],
+        raise_on_status=False
+    )
+))
+SESSION.headers.update({'Accept': 'application/vnd.retailer.v10+json'})
+
 # =================================================================
 # Configuratie Google BigQuery
 # =================================================================
@@ -36,145 +99,342 @@ PROJECT_ID = 'advertentiedata-bol-ds'
 DATASET_ID = 'DATASET_BOL_ADVERTENTIES_DS'
 TABLE_ID = 'ORDERDATA_BOL_DS'
 
+# Vast schema van de tabel, zodat de kolomtypes niet uit de data afgeleid hoeven te worden
+TABLE_SCHEMA = [
+    bigquery.SchemaField('Order ID', 'STRING'),
+    bigquery.SchemaField('Order Datum', 'STRING'),
+    bigquery.SchemaField('EAN', 'STRING'),
+    bigquery.SchemaField('Aantal', 'INTEGER'),
+    bigquery.SchemaField('Eenheidsprijs', 'FLOAT'),
+]
+
 # Haal de service account info op uit een omgevingsvariabele (GitHub Secret)
 SERVICE_ACCOUNT_INFO = json.loads(os.environ.get('GCP_SA_KEY'))
 
-# Globale variabele voor het opslaan van het token en de vervaltijd
+# Globale variabele voor het opslaan van het token en de vervaltijd (volgens time.monotonic)
 bol_toegangstoken = None
-token_verloopt_om = datetime.now()
+token_verloopt_om = 0.0
+# Zorgt dat maar een thread tegelijk een verlopen token vernieuwt
+token_lock = threading.Lock()
+
+# =================================================================
+# Rate limiting
+# =================================================================
+class TokenBucket:
+    """Thread-safe token bucket: laat aanroepen direct door zolang er tokens zijn en wacht alleen als de bucket leeg is."""
+
+    def __init__(self, per_seconde, capaciteit):
+        self.per_seconde = per_seconde
+        self.capaciteit = capaciteit
+        # Begin met een enkel token: een volle bucket bij de start zou bovenop het quotum
+        # van het eerste tijdvenster komen
+        self.tokens = 1
+        self.laatst_bijgevuld = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Neemt een token, en wacht eerst tot er een bijgevuld is als de bucket leeg is."""
+        while True:
+            with self.lock:
+                nu = time.monotonic()
+                self.tokens = min(self.capaciteit, self.tokens + (nu - self.laatst_bijgevuld) * self.per_seconde)
+                self.laatst_bijgevuld = nu
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wachttijd = (1 - self.tokens) / self.per_seconde
+            time.sleep(wachttijd)
+
+
+# De orderlijst krijgt geen burst: elke opgespaarde aanroep komt bovenop de 20 per minuut,
+# dus na een stille periode wordt er alleen op het quotum gepaced. Dit past bij het ophalen van
+# de pagina's een voor een: de volgende pagina wacht alleen nog het deel van de 3 seconden
+# dat de vorige aanroep niet al heeft gebruikt, en gelijktijdige dagen delen hetzelfde quotum.
+# Bij de details mag een opgespaarde batch wel in een keer weg; daarna wordt er gepaced op het quotum
+ORDERS_LIMITER = TokenBucket(ORDERS_PER_SECONDE, 1)
+ORDER_DETAILS_LIMITER = TokenBucket(ORDER_DETAILS_PER_SECONDE, MAX_GELIJKTIJDIGE_DETAILS)
 
 # =================================================================
 # Bol.com API authenticatie
 # =================================================================
-def krijg_bol_toegangstoken():
-    """Haalt het Bol.com authenticatie token op en slaat het op met vervaltijd."""
-    global bol_toegangstoken, token_verloopt_om
+def is_alleen_van_huidige_gebruiker(stat_resultaat):
+    """Controleert dat een bestand of map van de huidige gebruiker is en niet toegankelijk is voor anderen."""
+    if not hasattr(os, 'getuid'):
+        # Op Windows bestaan deze POSIX-eigenaar en -rechten niet
+        return True
+    return stat_resultaat.st_uid == os.getuid() and not stat_resultaat.st_mode & 0o077
 
-    print("Start: Bol.com authenticatie token ophalen...")
-    auth_string = f'{CLIENT_ID}:{CLIENT_SECRET}'
-    encoded_auth_string = base64.b64encode(auth_string.encode()).decode()
 
-    headers = {
-        'Authorization': f'Basic {encoded_auth_string}',
-        'Accept': 'application/vnd.retailer.v10+json'
-    }
-    data = {'grant_type': 'client_credentials'}
+def token_cache_map_is_veilig():
+    """Maakt de cachemap aan indien nodig en controleert dat alleen de huidige gebruiker erbij kan."""
+    try:
+        os.makedirs(TOKEN_CACHE_MAP, mode=0o700, exist_ok=True)
+        return is_alleen_van_huidige_gebruiker(os.stat(TOKEN_CACHE_MAP))
+    except OSError:
+        return False
+
+
+@contextmanager
+def token_cache_slot():
+    """Zorgt dat maar een proces tegelijk het token-cachebestand leest en ververst; geeft aan of de cache bruikbaar is."""
+    if not token_cache_map_is_veilig():
+        log.warning("De token-cachemap %s is niet afgeschermd; het token wordt niet gecachet.", TOKEN_CACHE_MAP)
+        yield False
+        return
+
+    if fcntl is None:
+        yield True
+        return
+
+    with open(f'{TOKEN_CACHE_BESTAND}.lock', 'w') as lock_bestand:
+        fcntl.flock(lock_bestand, fcntl.LOCK_EX)
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_bestand, fcntl.LOCK_UN)
 
+
+def laad_gecachte_token():
+    """Leest een eerder opgeslagen token uit het cachebestand, als het nog geldig is en bij deze client ID hoort."""
     try:
-        response = requests.post(TOKEN_URL, headers=headers, data=data)
-        response.raise_for_status()
-
-        response_json = response.json()
-        access_token = response_json.get('access_token')
-        expires_in = response_json.get('expires_in', 0)
-
-        if access_token:
-            print("Succes: Bol.com toegangstoken ontvangen.")
-            bol_toegangstoken = access_token
-            # Sla de vervaltijd op, met een kleine marge van 60 seconden
-            token_verloopt_om = datetime.now() + timedelta(seconds=expires_in - 60)
+        with open(TOKEN_CACHE_BESTAND, 'rb') as f:
+            if not is_alleen_van_huidige_gebruiker(os.fstat(f.fileno())):
+                return None
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if cache.get('client_id_hash') != CLIENT_ID_HASH:
+        return None
+
+    access_token = cache.get('access_token')
+    expires_at_epoch = cache.get('expires_at_epoch', 0)
+
+    # Gebruik dezelfde marge van 60 seconden als bij een nieuw opgehaald token
+    if access_token and expires_at_epoch - 60 > time.time():
+        return access_token, expires_at_epoch
+    return None
+
+
+def bewaar_token_in_cache(access_token, expires_at_epoch):
+    """Schrijft het token en de vervaltijd atomair weg naar het cachebestand."""
+    tijdelijk_bestand = None
+    try:
+        # mkstemp maakt een nieuw bestand met een onvoorspelbare naam, alleen leesbaar voor de huidige gebruiker
+        fd, tijdelijk_bestand = tempfile.mkstemp(dir=TOKEN_CACHE_MAP, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'client_id_hash': CLIENT_ID_HASH,
+                'access_token': access_token,
+                'expires_at_epoch': expires_at_epoch
+            }, f)
+        os.replace(tijdelijk_bestand, TOKEN_CACHE_BESTAND)
+    except OSError as e:
+        log.warning("Kan het toegangstoken niet in de cache opslaan: %s", e)
+        if tijdelijk_bestand and os.path.exists(tijdelijk_bestand):
+            os.remove(tijdelijk_bestand)
+
+
+def verwijder_gecachte_token():
+    """Verwijdert het cachebestand, zodat een door de API geweigerd token niet opnieuw wordt gebruikt."""
+    try:
+        os.remove(TOKEN_CACHE_BESTAND)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        log.warning("Kan het gecachete toegangstoken niet verwijderen: %s", e)
+
+
+def krijg_bol_toegangstoken(gebruik_cache=True):
+    """Haalt het Bol.com authenticatie token op (uit de cache of via de API) en slaat het op met vervaltijd."""
+    global bol_toegangstoken, token_verloopt_om
+
+    with token_cache_slot() as cache_bruikbaar:
+        if cache_bruikbaar and not gebruik_cache:
+            verwijder_gecachte_token()
+
+        gecachte_token = laad_gecachte_token() if cache_bruikbaar and gebruik_cache else None
+        if gecachte_token:
+            log.info("Succes: Bol.com toegangstoken uit de cache geladen.")
+            bol_toegangstoken, expires_at_epoch = gecachte_token
+            token_verloopt_om = time.monotonic() + (expires_at_epoch - time.time()) - 60
+            SESSION.headers['Authorization'] = f'Bearer {bol_toegangstoken}'
             return bol_toegangstoken
-        else:
-            print("[FOUT] Geen toegangstoken ontvangen.")
+
+        log.info("Start: Bol.com authenticatie token ophalen...")
+        auth_string = f'{CLIENT_ID}:{CLIENT_SECRET}'
+        encoded_auth_string = base64.b64encode(auth_string.encode()).decode()
+
+        # Deze header overschrijft voor deze aanroep de Bearer-header van de sessie
+        headers = {'Authorization': f'Basic {encoded_auth_string}'}
+        data = {'grant_type': 'client_credentials'}
+
+        try:
+            response = SESSION.post(TOKEN_URL, headers=headers, data=data, timeout=HTTP_TIMEOUT)
+            response.raise_for_status()
+
+            response_json = orjson.loads(response.content)
+            access_token = response_json.get('access_token')
+            expires_in = response_json.get('expires_in', 0)
+
+            if access_token:
+                log.info("Succes: Bol.com toegangstoken ontvangen.")
+                bol_toegangstoken = access_token
+                # Sla de vervaltijd op, met een kleine marge van 60 seconden
+                token_verloopt_om = time.monotonic() + expires_in - 60
+                SESSION.headers['Authorization'] = f'Bearer {bol_toegangstoken}'
+                if cache_bruikbaar:
+                    bewaar_token_in_cache(access_token, time.time() + expires_in)
+                return bol_toegangstoken
+            else:
+                log.error("Geen toegangstoken ontvangen.")
+                return None
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+            log.error("Fout bij het ophalen van het Bol.com toegangstoken: %s", e)
             return None
-    except requests.exceptions.RequestException as e:
-        print(f"[FOUT] Fout bij het ophalen van het Bol.com toegangstoken: {e}")
-        return None
 
 
 def check_en_vernieuwt_token():
     """Controleert of het token nog geldig is en vernieuwt het indien nodig."""
+    # Snelle controle zonder lock: dit wordt per API-aanroep gedaan en is bijna altijd geldig
+    if bol_toegangstoken is not None and time.monotonic() < token_verloopt_om:
+        return bol_toegangstoken
+
+    with token_lock:
+        # Een andere thread kan het token inmiddels al vernieuwd hebben
+        if bol_toegangstoken is None or time.monotonic() >= token_verloopt_om:
+            log.info("Token is verlopen of niet aanwezig. Vernieuwen...")
+            return krijg_bol_toegangstoken()
+        return bol_toegangstoken
+
+
+def vernieuw_geweigerd_token(geweigerd_token):
+    """Verwerpt een token dat de API met een 401 heeft geweigerd en haalt een nieuw token op, buiten de cache om."""
     global bol_toegangstoken, token_verloopt_om
-    if bol_toegangstoken is None or datetime.now() >= token_verloopt_om:
-        print("Token is verlopen of niet aanwezig. Vernieuwen...")
-        return krijg_bol_toegangstoken()
-    return bol_toegangstoken
+
+    with token_lock:
+        # Een andere thread kan het geweigerde token inmiddels al vervangen hebben
+        if bol_toegangstoken != geweigerd_token:
+            return bol_toegangstoken
+
+        # De Authorization-header blijft staan tot krijg_bol_toegangstoken hem overschrijft: andere threads
+        # lezen de sessieheaders tijdens hun aanroep, en een verwijderde sleutel zou hen kunnen laten falen
+        bol_toegangstoken = None
+        token_verloopt_om = 0.0
+        return krijg_bol_toegangstoken(gebruik_cache=False)
 
 
 # =================================================================
 # Orders ophalen
 # =================================================================
-def maak_api_call_met_retry(method, url, headers, params=None, data=None):
-    """Maakt een API-aanroep en probeert het opnieuw bij een 429-fout."""
+def bepaal_wachttijd(response, attempt):
+    """Bepaalt de wachttijd na een 429 of 503: de Retry-After header indien aanwezig, anders exponentiele backoff met jitter."""
+    retry_after = response.headers.get('Retry-After', '')
+    if retry_after.isdigit():
+        return int(retry_after)
+    return random.uniform(1, min(60, 2 ** (attempt + 1)))
+
+
+def maak_api_call_met_retry(method, url, params=None, data=None, limiter=None):
+    """Maakt een API-aanroep via de gedeelde sessie en probeert het opnieuw bij een 429- of 503-fout."""
     for attempt in range(MAX_RETRY_ATTEMPTS):
+        # Ook een nieuwe poging telt mee voor het quotum
+        if limiter:
+            limiter.acquire()
+        # Het token waarmee deze poging wordt gedaan, voor het geval de API het weigert
+        gebruikte_token = bol_toegangstoken
         try:
             if method == 'GET':
-                response = requests.get(url, headers=headers, params=params)
+                response = SESSION.get(url, params=params, timeout=HTTP_TIMEOUT)
             else:
-                response = requests.post(url, headers=headers, data=data)
+                response = SESSION.post(url, data=data, timeout=HTTP_TIMEOUT)
             response.raise_for_status()
             return response
         except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 429:
-                wait_time = (attempt + 1) * 60
-                print(
-                    f"[WAARSCHUWING] Rate limit overschreden (429). Wacht {wait_time} seconden. Poging {attempt + 1} van {MAX_RETRY_ATTEMPTS}.")
+            if e.response.status_code in (429, 503):
+                # Bij rate limiting (429) en tijdelijke onbeschikbaarheid (503) volgen we de server
+                wait_time = bepaal_wachttijd(e.response, attempt)
+                log.warning(
+                    "Rate limit overschreden of API tijdelijk onbeschikbaar (%s). Wacht %.1f seconden. Poging %s van %s.",
+                    e.response.status_code, wait_time, attempt + 1, MAX_RETRY_ATTEMPTS)
                 time.sleep(wait_time)
             elif e.response.status_code == 401:
-                # Als het token niet meer geldig is, proberen we het te vernieuwen en de aanroep opnieuw te doen
-                print("[WAARSCHUWING] 401 Unauthorized. Token wordt vernieuwd en aanroep wordt opnieuw geprobeerd.")
-                check_en_vernieuwt_token()
-                headers['Authorization'] = f'Bearer {bol_toegangstoken}'
+                # Het token is geweigerd, ook al is het lokaal nog niet verlopen: gooi het (ook uit de cache)
+                # weg, haal een nieuw token op en doe de aanroep opnieuw.
+                # Het vernieuwde token wordt direct in de headers van de sessie gezet.
+                log.warning("401 Unauthorized. Token wordt vernieuwd en aanroep wordt opnieuw geprobeerd.")
+                vernieuw_geweigerd_token(gebruikte_token)
                 continue
             else:
                 raise e
     raise requests.exceptions.RequestException(f"API-aanroep mislukt na {MAX_RETRY_ATTEMPTS} pogingen.")
 
 
-def krijg_alle_orders_van_dag(datum):
-    """Haalt alle orders op die zijn gewijzigd op een specifieke datum."""
-    print(f"Start: Orders ophalen voor datum: {datum}...")
-    orders_url = f'{API_BASE_URL}/orders'
-    alle_orders = []
-    page = 1
+def krijg_orders_pagina(basis_params, page):
+    """Haalt een pagina met orders op, met de vaste zoekparameters aangevuld met het paginanummer."""
+    params = {**basis_params, 'page': page}
+    # De URL wordt alleen opgebouwd als debug-logging aanstaat
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("URL van aanroep: %s?%s", ORDERS_URL, urlencode(params))
+
+    response = maak_api_call_met_retry('GET', ORDERS_URL, params=params, limiter=ORDERS_LIMITER)
+    # orjson parseert de (geneste) orderpagina's sneller dan de standaard json-module
+    return orjson.loads(response.content).get('orders', [])
+
+
+def krijg_alle_orders_van_dag(datum, alleen_geplaatst_op_datum=False):
+    """Haalt alle orders op die zijn gewijzigd op een specifieke datum, optioneel alleen die ook op die datum zijn geplaatst."""
+    log.info("Start: Orders ophalen voor datum: %s...", datum)
 
     token = check_en_vernieuwt_token()
     if not token:
-        print("[KRITIEKE FOUT] Geen geldig Bol.com toegangstoken beschikbaar.")
+        log.critical("Geen geldig Bol.com toegangstoken beschikbaar.")
         return None
 
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Accept': 'application/vnd.retailer.v10+json'
-    }
-
     try:
         datetime.strptime(datum, "%Y-%m-%d")
     except ValueError:
-        print(f"[FOUT] Ongeldig datumformaat: {datum}. Gebruik 'YYYY-MM-DD'.")
+        log.error("Ongeldig datumformaat: %s. Gebruik 'YYYY-MM-DD'.", datum)
         return None
 
-    while True:
-        params = {
-            'latest-change-date': datum,
-            'fulfilment-method': 'ALL',
-            'status': 'ALL',
-            'page': page,
-            'page-size': PAGE_SIZE
-        }
-
-        print(f"[DEBUG] URL van aanroep: {requests.Request('GET', orders_url, params=params).prepare().url}")
+    # De parameters die voor elke pagina gelijk zijn, worden maar een keer opgebouwd
+    basis_params = {
+        'latest-change-date': datum,
+        'fulfilment-method': 'ALL',
+        'status': 'ALL',
+        'page-size': PAGE_SIZE
+    }
 
-        try:
-            response = maak_api_call_met_retry('GET', orders_url, headers, params=params)
-            response_json = response.json()
-            orders = response_json.get('orders', [])
-            for order in orders:
-                alle_orders.append(order.get('orderId'))
+    def order_ids(orders):
+        # Orders die alleen op deze datum zijn gewijzigd maar eerder zijn geplaatst, worden desgewenst
+        # al hier overgeslagen, zodat hun details niet opgehaald hoeven te worden
+        return (
+            order.get('orderId') for order in orders
+            if not alleen_geplaatst_op_datum or (order.get('orderPlacedDateTime') or '').startswith(datum)
+        )
 
-            if len(orders) < PAGE_SIZE or page >= MAX_PAGINA:
-                break
+    # Een set, zodat orders die op meerdere pagina's terugkomen direct maar een keer meetellen
+    alle_orders = set()
+    laatste_pagina_bereikt = False
+    page = 0
 
+    try:
+        # De orderlijst wordt door ORDERS_LIMITER strikt op het quotum gepaced, dus tegelijk opvragen
+        # levert geen tijd op. Pagina's worden een voor een opgehaald tot een pagina niet meer vol is,
+        # zodat er nooit een pagina na de laatste wordt opgevraagd.
+        while not laatste_pagina_bereikt and page < MAX_PAGINA:
             page += 1
-            time.sleep(SLEEP_TIME_ORDERS)
+            orders = krijg_orders_pagina(basis_params, page)
+            alle_orders.update(order_ids(orders))
+            laatste_pagina_bereikt = len(orders) < PAGE_SIZE
 
-        except requests.exceptions.RequestException as req_err:
-            print(f"[FOUT] Fout bij het ophalen van orders: {req_err}")
-            return None
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as req_err:
+        log.error("Fout bij het ophalen van orders: %s", req_err)
+        return None
 
-    print(f"Uiteindelijk zijn er {len(alle_orders)} order-ID's geselecteerd voor {datum}.")
-    if page > MAX_PAGINA:
-        print(f"[INFO] Let op: De verwerking is gestopt na {MAX_PAGINA} pagina's.")
+    log.info("Uiteindelijk zijn er %s order-ID's geselecteerd voor %s.", len(alle_orders), datum)
+    if not laatste_pagina_bereikt:
+        log.info("Let op: De verwerking is gestopt na %s pagina's.", MAX_PAGINA)
     return alle_orders
 
 
@@ -187,120 +447,230 @@ def krijg_order_details(order_id):
     if not token:
         return None
 
-    details_url = f'{API_BASE_URL}/orders/{order_id}'
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Accept': 'application/vnd.retailer.v10+json'
-    }
+    details_url = f'{ORDERS_URL}/{order_id}'
 
     try:
-        response = maak_api_call_met_retry('GET', details_url, headers)
-        time.sleep(SLEEP_TIME_ORDER_DETAILS)
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"[FOUT] Fout bij ophalen orderdetails voor {order_id}: {e}")
+        response = maak_api_call_met_retry('GET', details_url, limiter=ORDER_DETAILS_LIMITER)
+        return orjson.loads(response.content)
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+        log.error("Fout bij ophalen orderdetails voor %s: %s", order_id, e)
         return None
 
 
+def warm_api_verbinding_op():
+    """Zet alvast een verbinding (DNS, TCP en TLS) op met de Bol.com API, die de eerste echte aanroep kan hergebruiken."""
+    try:
+        SESSION.head(API_BASE_URL, timeout=10)
+    except requests.exceptions.RequestException:
+        # Alleen een optimalisatie; de echte aanroepen zetten zelf een verbinding op
+        pass
+
+
 # =================================================================
 # Push naar BigQuery in batches
 # =================================================================
-def push_data_to_bigquery(df, project_id, dataset_id, table_id, service_account_info):
-    """Pusht de pandas DataFrame naar een BigQuery tabel."""
-    print(f"Start: Gegevens naar BigQuery pushen met 'append' optie...")
+def maak_bigquery_client(project_id, service_account_info):
+    """Maakt de BigQuery client aan met de service account gegevens."""
+    # Hier wordt de service account info gebruikt die als JSON object is ingeladen
+    credentials = service_account.Credentials.from_service_account_info(service_account_info)
+    return bigquery.Client(project=project_id, credentials=credentials)
+
+
+def push_data_to_bigquery(df, bigquery_client_future, project_id, dataset_id, table_id):
+    """Pusht de pandas DataFrame naar een BigQuery tabel, met de (op de achtergrond aangemaakte) client.
+    Geeft aan of het laden gelukt is."""
+    log.info("Start: Gegevens naar BigQuery pushen met 'append' optie...")
     try:
-        # Hier wordt de service account info gebruikt die als JSON object is ingeladen
-        credentials = service_account.Credentials.from_service_account_info(service_account_info)
-        pandas_gbq.to_gbq(
-            dataframe=df,
-            destination_table=f'{dataset_id}.{table_id}',
-            project_id=project_id,
-            credentials=credentials,
-            if_exists='append'
+        client = bigquery_client_future.result()
+
+        # Laad de data als Parquet in een enkele batch load job: binair en kolomgewijs,
+        # zonder de quota van de streaming API
+        job_config = bigquery.LoadJobConfig(
+            schema=TABLE_SCHEMA,
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND
         )
-        print(f"Succes: {len(df)} rijen zijn succesvol naar BigQuery geschreven.")
+        job = client.load_table_from_dataframe(df, f'{project_id}.{dataset_id}.{table_id}', job_config=job_config)
+        job.result()
+        log.info("Succes: %s rijen zijn succesvol naar BigQuery geschreven.", len(df))
+        return True
     except Exception as e:
-        print(f"[KRITIEKE FOUT] Fout bij het pushen van gegevens naar BigQuery: {e}")
-        return
+        log.critical("Fout bij het pushen van gegevens naar BigQuery: %s", e)
+        return False
 
 
 # =================================================================
 # Hoofdverwerking
 # =================================================================
-def verwerk_orders_per_dag(datum):
+# Order-ID's die in deze run al verwerkt worden. Bij een backfill komt een order die op meerdere
+# dagen is gewijzigd zo maar een keer in BigQuery terecht, en worden de details maar een keer opgehaald.
+verwerkte_order_ids = set()
+verwerkte_order_ids_lock = threading.Lock()
+
+# Resultaat van een dag waarvan de orders niet opgehaald konden worden; anders dan None (geen orders)
+# moet zo'n dag opnieuw worden verwerkt
+DAG_MISLUKT = object()
+
+
+def verwerk_orders_per_dag(datum, alleen_geplaatst_op_datum=False):
     """Verwerkt orders van een bepaalde dag en haalt de details op."""
-    order_ids_op_datum = krijg_alle_orders_van_dag(datum)
+    order_ids_op_datum = krijg_alle_orders_van_dag(datum, alleen_geplaatst_op_datum)
+
+    if order_ids_op_datum is None:
+        log.error("Orders ophalen voor %s is mislukt. Deze dag moet opnieuw worden verwerkt.", datum)
+        return DAG_MISLUKT
 
     if not order_ids_op_datum:
-        print(f"Geen orders om te verwerken voor {datum}. Door naar de volgende dag.")
+        log.info("Geen orders om te verwerken voor %s. Door naar de volgende dag.", datum)
         return None
 
-    order_details_lijst = []
-    unieke_order_ids = set(order_ids_op_datum)
+    # De orders worden vooraf geclaimd, zodat gelijktijdige dagen niet dezelfde details ophalen
+    with verwerkte_order_ids_lock:
+        unieke_order_ids = order_ids_op_datum - verwerkte_order_ids
+        verwerkte_order_ids.update(unieke_order_ids)
+
+    # Per kolom een lijst; alleen de benodigde waarden worden bewaard, zodat de volledige
+    # orderdetails (klant- en verzendgegevens) direct weer vrijgegeven kunnen worden
+    order_ids, order_datums, eans, aantallen, eenheidsprijzen = [], [], [], [], []
+
+    # De details worden tegelijk opgehaald en verwerkt zodra ze binnen zijn
+    with ThreadPoolExecutor(max_workers=MAX_GELIJKTIJDIGE_DETAILS) as executor:
+        for order_id, order_details in zip(unieke_order_ids, executor.map(krijg_order_details, unieke_order_ids)):
+            if order_details is None:
+                # Ophalen mislukt: geef de order weer vrij, zodat een latere dag hem nog kan verwerken
+                with verwerkte_order_ids_lock:
+                    verwerkte_order_ids.discard(order_id)
+                continue
+
+            orderregels = order_details.get('orderItems')
+
+            # Een order zonder (geldige) orderregels wordt overgeslagen, zodat een enkele
+            # afwijkende order niet de verwerking van de hele dag laat mislukken
+            if not isinstance(orderregels, list) or not orderregels:
+                continue
 
-    for order_id in unieke_order_ids:
-        order_details = krijg_order_details(order_id)
-        if order_details and 'orderItems' in order_details:
             order_datum_tijd = order_details.get('orderPlacedDateTime')
-            for item in order_details['orderItems']:
-                product_details = item.get('product', {})
-                ean = product_details.get('ean')
-                eenheidsprijs_bedrag = item.get('unitPrice')
-
-                # Controleer of de eenheidsprijs een nummer is voordat je gaat delen
-                if isinstance(eenheidsprijs_bedrag, (int, float)):
-                    # Deel de prijs door 1,21 om de prijs exclusief btw te krijgen
-                    eenheidsprijs_excl_btw = round(eenheidsprijs_bedrag / 1.21, 2)
-                else:
-                    eenheidsprijs_excl_btw = None
-                
-                order_details_lijst.append({
-                    "Order ID": order_id,
-                    "Order Datum": order_datum_tijd,
-                    "EAN": ean,
-                    "Aantal": item.get('quantity'),
-                    # Gebruik de nieuwe variabele met de prijs exclusief btw
-                    "Eenheidsprijs": eenheidsprijs_excl_btw
-                })
-
-    if order_details_lijst:
-        df = pd.DataFrame(order_details_lijst)
-        return df
-    else:
-        print(f"[INFO] Geen order items gevonden om te exporteren voor {datum}.")
+            for item in orderregels:
+                order_ids.append(order_id)
+                order_datums.append(order_datum_tijd)
+                eans.append((item.get('product') or {}).get('ean'))
+                aantallen.append(item.get('quantity'))
+                eenheidsprijzen.append(item.get('unitPrice'))
+
+    if not order_ids:
+        log.info("Geen order items gevonden om te exporteren voor %s.", datum)
         return None
 
+    df = pd.DataFrame({
+        "Order ID": order_ids,
+        "Order Datum": order_datums,
+        "EAN": eans,
+        "Aantal": aantallen,
+        "Eenheidsprijs": eenheidsprijzen
+    })
+
+    # Deel de prijs door 1,21 om de prijs exclusief btw te krijgen; niet-numerieke prijzen worden leeg
+    df['Eenheidsprijs'] = pd.to_numeric(df['Eenheidsprijs'], errors='coerce').div(1.21).round(2)
+
+    # Expliciete kolomtypes die aansluiten op TABLE_SCHEMA, in plaats van generieke object-kolommen.
+    # 'Order Datum' blijft tekst, omdat de kolom in de bestaande tabel een STRING is.
+    df = df.astype({'Order ID': 'string', 'Order Datum': 'string', 'EAN': 'string'})
+    df['Aantal'] = pd.to_numeric(df['Aantal'], errors='coerce').astype('Int64')
+    return df
+
+
+def lees_argumenten():
+    """Leest de te verwerken datums (standaard alleen gisteren) en de opties uit de command line."""
+    def datum(waarde):
+        try:
+            return datetime.strptime(waarde, "%Y-%m-%d").date()
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Ongeldig datumformaat: {waarde}. Gebruik 'YYYY-MM-DD'.")
+
+    parser = argparse.ArgumentParser(description="Synchroniseert Bol.com orders naar BigQuery.")
+    parser.add_argument('--start', type=datum, help="Eerste datum (YYYY-MM-DD) van een backfill; standaard gisteren.")
+    parser.add_argument('--end', type=datum, help="Laatste datum (YYYY-MM-DD) van een backfill; standaard gelijk aan --start.")
+    parser.add_argument('--alleen-geplaatst-op-datum', action='store_true',
+                        help="Verwerk alleen orders die ook op de datum zelf zijn geplaatst, niet alleen gewijzigd.")
+    argumenten = parser.parse_args()
+
+    # Bepaal de datum van gisteren; alles als date, zodat de tijd van de dag niet meetelt
+    start = argumenten.start or date.today() - timedelta(days=1)
+    eind = argumenten.end or start
+    if eind < start:
+        parser.error("--end mag niet voor --start liggen.")
+
+    datums = [(start + timedelta(days=dag)).strftime("%Y-%m-%d") for dag in range((eind - start).days + 1)]
+    return datums, argumenten.alleen_geplaatst_op_datum
+
 
 # =================================================================
 # Main script
 # =================================================================
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
     start_tijd = time.time()
+    datums, alleen_geplaatst_op_datum = lees_argumenten()
+
+    # Terwijl het token wordt opgehaald, worden op de achtergrond de BigQuery client
+    # aangemaakt en de verbinding met de Bol.com API opgewarmd
+    opstart_executor = ThreadPoolExecutor(max_workers=2)
+    bigquery_client_future = opstart_executor.submit(maak_bigquery_client, PROJECT_ID, SERVICE_ACCOUNT_INFO)
+    opstart_executor.submit(warm_api_verbinding_op)
+    opstart_executor.shutdown(wait=False)
 
     # Eerste keer token ophalen
     krijg_bol_toegangstoken()
 
+    # Dagen die opnieuw moeten worden verwerkt; bepalen aan het einde de exitcode
+    mislukte_datums = []
+
     if not bol_toegangstoken:
-        print("[KRITIEKE FOUT] Kan niet verder. Bol.com authenticatie is mislukt.")
+        log.critical("Kan niet verder. Bol.com authenticatie is mislukt.")
+        mislukte_datums = datums
     else:
-        # Bepaal de datum van gisteren
-        datum_gisteren = datetime.now() - timedelta(days=1)
-        datum_string = datum_gisteren.strftime("%Y-%m-%d")
-
-        print(f"\n--- Verwerking gestart voor datum: {datum_string} ---")
-        df_per_dag = verwerk_orders_per_dag(datum_string)
-        if df_per_dag is not None:
-            push_data_to_bigquery(df_per_dag, PROJECT_ID, DATASET_ID, TABLE_ID, SERVICE_ACCOUNT_INFO)
-        print(f"--- Verwerking voltooid voor datum: {datum_string} ---\n")
+        log.info("--- Verwerking gestart voor datum: %s t/m %s ---", datums[0], datums[-1])
+
+        # Bij een backfill worden meerdere dagen tegelijk verwerkt; de rate limiters zijn gedeeld,
+        # dus samen blijven ze binnen het quotum van de Bol.com API
+        with ThreadPoolExecutor(max_workers=MAX_GELIJKTIJDIGE_DAGEN) as executor:
+            verwerk_dag = partial(verwerk_orders_per_dag, alleen_geplaatst_op_datum=alleen_geplaatst_op_datum)
+            futures = [(datum, executor.submit(verwerk_dag, datum)) for datum in datums]
+
+        # Een fout in een dag stopt de andere dagen niet; de dag wordt als mislukt gemeld
+        dataframes, datums_met_data = [], []
+        for datum, future in futures:
+            try:
+                resultaat = future.result()
+            except Exception as e:
+                log.error("Onverwachte fout bij het verwerken van %s: %s", datum, e)
+                resultaat = DAG_MISLUKT
+
+            if resultaat is DAG_MISLUKT:
+                mislukte_datums.append(datum)
+            elif resultaat is not None:
+                dataframes.append(resultaat)
+                datums_met_data.append(datum)
+
+        # Alle dagen samen gaan in een enkele load job naar BigQuery
+        # Mislukt het laden, dan moeten alle dagen met data opnieuw worden verwerkt
+        if dataframes and not push_data_to_bigquery(
+                pd.concat(dataframes, ignore_index=True), bigquery_client_future, PROJECT_ID, DATASET_ID, TABLE_ID):
+            mislukte_datums = sorted(mislukte_datums + datums_met_data)
+        log.info("--- Verwerking voltooid voor datum: %s t/m %s ---", datums[0], datums[-1])
 
     eind_tijd = time.time()
     totale_tijd_seconden = eind_tijd - start_tijd
     minuten = int(totale_tijd_seconden // 60)
     seconden = int(totale_tijd_seconden % 60)
 
-    print("\n=================================================================")
-    print("                 Script voltooid")
-    print(f"  Totaal duur: {minuten} minuut(en) en {seconden} seconde(n)")
-    print("=================================================================")
+    log.info("=================================================================")
+    log.info("                 Script voltooid")
+    log.info("  Totaal duur: %s minuut(en) en %s seconde(n)", minuten, seconden)
+    log.info("=================================================================")
+
+    if mislukte_datums:
+        log.error("Niet verwerkte datums, opnieuw uitvoeren voor: %s", ', '.join(mislukte_datums))
+        sys.exit(1)
 
 